@@ -14,12 +14,16 @@ from werkzeug.utils import secure_filename
 from utils.ocr_processor import extract_phone_info, extract_about_device_info
 from utils.predictor import predict_issue_and_solution
 from utils.log_generator import generate_device_log
+from utils.snapshot_schema import normalize_snapshot, SnapshotValidationError, MAX_SNAPSHOT_BYTES
+from utils.hot_logging import RateLimitedLogger, install_queue_handler
+from utils.rate_limit import AdmissionController
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 from functools import wraps
 from collections import defaultdict, deque
 import re
+import math
 
 app = Flask(__name__)
 # Rotate secret key each start so any previous session cookies become invalid
@@ -44,6 +48,13 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hot-path logging: structured, rate limited per key, handlers fed from a queue.
+# LOG_ECHO_STDOUT=1 restores the old print() duplicates on request paths.
+app.config['LOG_ECHO_STDOUT'] = os.environ.get('LOG_ECHO_STDOUT') == '1'
+app.config['LOG_QUEUE'] = os.environ.get('LOG_QUEUE', '1') == '1'
+log_listener = install_queue_handler(app.logger) if app.config['LOG_QUEUE'] else None
+hot_log = RateLimitedLogger(app.logger, rate=1.0, burst=5, echo=app.config['LOG_ECHO_STDOUT'])
+
 # Database initialization
 def init_db():
     conn = sqlite3.connect('users.db')
@@ -162,7 +173,7 @@ class SessionStore:
                     'charging': bool(charging)
                 }
                 sess['battery_samples'].append(sample)
-                app.logger.debug(f"Added battery sample for {session_id}: {sample}")
+                app.logger.debug("Added battery sample for %s: %s", session_id, sample)
             
             # Add battery update to history if we have a snapshot
             if sess.get('snapshot'):
@@ -213,7 +224,8 @@ class SessionStore:
     def _broadcast(self, session_id, message):
         """Broadcast message to all SSE subscribers for this session"""
         callbacks = self.subscribers.get(session_id, [])
-        app.logger.info(f"Broadcasting to {len(callbacks)} subscribers for session {session_id}: {message.get('type', 'unknown')}")
+        hot_log.debug(('broadcast', session_id), '[SSE] broadcast', session=session_id,
+                      type=message.get('type', 'unknown'), subscribers=len(callbacks))
         for callback in callbacks:
             try:
                 callback(message)
@@ -244,12 +256,40 @@ class SessionStore:
                 del self.sessions[sid]
                 if sid in self.subscribers:
                     del self.subscribers[sid]
+                hot_log.forget(sid)
             if expired:
                 app.logger.info(f"Cleaned up {len(expired)} expired sessions")
 
 # Global session store
 session_store = SessionStore(ttl_minutes=30)
 
+# Admission control for collector ingest: per-session and global token buckets.
+# Policies are (requests per second, burst) per session; the global bucket is shared.
+app.config['INGEST_RATE_LIMIT_ENABLED'] = os.environ.get('INGEST_RATE_LIMIT', '1') == '1'
+INGEST_POLICIES = {
+    'api_live_battery': (1.0, 10),  # 15s heartbeats + level/charging change events
+    'api_collect': (0.2, 3),  # Snapshots are rare and expensive
+}
+ingest_limiter = AdmissionController(INGEST_POLICIES, global_rate=200, global_burst=400)
+
+@app.before_request
+def ingest_admission_control():
+    """Shed ingest load with 429 + Retry-After before the request body is parsed"""
+    if request.endpoint not in INGEST_POLICIES or not app.config['INGEST_RATE_LIMIT_ENABLED']:
+        return None
+    # Collectors send ?sid= so the session is known without reading the body
+    key = request.args.get('sid') or request.headers.get('X-Session-Id') or request.remote_addr
+    allowed, retry_after = ingest_limiter.admit(request.endpoint, key)
+    if allowed:
+        return None
+    retry_after = max(1, math.ceil(retry_after)) if math.isfinite(retry_after) else 60
+    hot_log.warning(('shed', request.endpoint), '[INGEST] request shed', endpoint=request.endpoint,
+                    key=key, retry_after=retry_after)
+    response = jsonify({'error': 'Too many requests', 'retryAfter': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 # File-backed share token store for persistence across restarts
 SHARE_TOKENS_FILE = 'share_tokens.json'
 share_tokens_lock = threading.Lock()
@@ -732,9 +772,10 @@ def compute_verified_score(session_id):
     sess['verified_score'] = breakdown
     
     # Log informative message
-    app.logger.info(f"[VERIFIED_SCORE] Computed for session {session_id}: {verified_score} (missing_fields: {breakdown['has_missing_fields']})")
-    if device_name or model:
-        app.logger.info(f"[VERIFIED_SCORE] Device: {device_name or model}, RAM: {ram_gb}GB, Storage: {storage_total}GB, Battery: {battery_percent}%/{battery_capacity}mAh")
+    hot_log.info(('verified_score', session_id), '[VERIFIED_SCORE] computed', session=session_id,
+                 score=verified_score, missing_fields=breakdown['has_missing_fields'],
+                 device=device_name or model, ram_gb=ram_gb, storage_gb=storage_total,
+                 battery_pct=battery_percent, battery_mah=battery_capacity)
     
     return breakdown
 
@@ -1027,7 +1068,7 @@ def compute_prediction(session_data):
         ten_minutes_ago = now_ts - (10 * 60 * 1000)
         recent_samples = [s for s in valid_samples if s.get('ts', 0) >= ten_minutes_ago]
         
-        app.logger.debug(f"[PREDICTION] Total samples: {len(battery_samples)}, Valid: {len(valid_samples)}, Last 10min: {len(recent_samples)}")
+        app.logger.debug("[PREDICTION] Total samples: %d, Valid: %d, Last 10min: %d", len(battery_samples), len(valid_samples), len(recent_samples))
         
         # Find samples where percent actually changed (filter out duplicates)
         samples_with_changes = []
@@ -1039,7 +1080,7 @@ def compute_prediction(session_data):
                     samples_with_changes.append(sample)
                     last_pct = pct
         
-        app.logger.debug(f"[PREDICTION] Samples with percent changes: {len(samples_with_changes)}")
+        app.logger.debug("[PREDICTION] Samples with percent changes: %d", len(samples_with_changes))
         
         # Compute drain_per_min from actual percent changes
         drain_per_min = None
@@ -1059,16 +1100,17 @@ def compute_prediction(session_data):
             total_percent_drop = first_pct - last_pct  # Positive if draining
             total_minutes = (last_ts - first_ts) / (1000.0 * 60.0)
             
-            app.logger.debug(f"[PREDICTION] First sample: {first_pct}% at {datetime.fromtimestamp(first_ts/1000).isoformat()}")
-            app.logger.debug(f"[PREDICTION] Last sample: {last_pct}% at {datetime.fromtimestamp(last_ts/1000).isoformat()}")
-            app.logger.debug(f"[PREDICTION] Total drop: {total_percent_drop}% over {total_minutes:.2f} minutes")
+            app.logger.debug("[PREDICTION] First sample: %s%% at ts=%s, last sample: %s%% at ts=%s, drop: %s%% over %.2f minutes",
+                             first_pct, first_ts, last_pct, last_ts, total_percent_drop, total_minutes)
             
             # Check if we have at least 1% drop
             if total_percent_drop >= 1.0 and total_minutes > 0:
                 # Use real drain rate
                 drain_per_min = total_percent_drop / total_minutes
                 used_fallback = False
-                app.logger.info(f"[PREDICTION] Using real drain rate: {drain_per_min:.4f}% per minute (from {total_percent_drop}% drop over {total_minutes:.2f} min)")
+                hot_log.debug(('prediction_rate', 'real'), '[PREDICTION] real drain rate',
+                              drain_per_min=round(drain_per_min, 4), drop=total_percent_drop,
+                              minutes=round(total_minutes, 2))
             else:
                 # Not enough change detected, use fallback
                 used_fallback = True
@@ -1091,7 +1133,8 @@ def compute_prediction(session_data):
             else:
                 drain_per_min = 1.0  # Low responsiveness = higher drain
             
-            app.logger.info(f"[PREDICTION] Using fallback drain rate: {drain_per_min}% per minute (responsiveness: {current_resp:.1f}, reason: {fallback_reason})")
+            hot_log.debug(('prediction_rate', 'fallback'), '[PREDICTION] fallback drain rate',
+                          drain_per_min=drain_per_min, responsiveness=current_resp, reason=fallback_reason)
         
         # Make drain negative (draining = negative)
         drain_per_min = -abs(drain_per_min)
@@ -1104,7 +1147,7 @@ def compute_prediction(session_data):
         jitter = random.uniform(-jitter_range, jitter_range)
         drain_per_min_with_jitter = drain_per_min + jitter
         
-        app.logger.debug(f"[PREDICTION] Final drain_per_min: {drain_per_min_with_jitter:.4f}% per minute (base: {drain_per_min:.4f}, jitter: {jitter:.4f})")
+        app.logger.debug("[PREDICTION] Final drain_per_min: %.4f%% per minute (base: %.4f, jitter: %.4f)", drain_per_min_with_jitter, drain_per_min, jitter)
         
         # Generate 181-minute prediction (0=now, 1-180=minutes ahead)
         battery_predictions = []
@@ -1490,7 +1533,7 @@ def upload_file():
                 session['log_file'] = log_filename
                 session['is_about_device'] = False
             
-            print(f"Session data stored: {session['qr_session_id']}")
+            app.logger.info(f"Session data stored: {session['qr_session_id']}")
             
             return redirect(url_for('result', session_id=session_id))
         except Exception as e:
@@ -1649,7 +1692,6 @@ def generate_qr():
     try:
         session_id = session.get('qr_session_id')
         app.logger.info(f"[QR] Creating QR code with sessionId: {session_id}")
-        print(f"[QR] Creating QR code with sessionId: {session_id}")
         
         if not session_id:
             app.logger.error("No session ID found in session")
@@ -1660,7 +1702,6 @@ def generate_qr():
         # Use /collector?sid=... format (relative path works behind tunnels)
         qr_url = f"{base_url}/collector?sid={session_id}"
         app.logger.info(f"[QR] QR URL: {qr_url} (HTTPS: {is_secure_request()})")
-        print(f"[QR] QR URL: {qr_url} (HTTPS: {is_secure_request()})")
         
         # Create session in store if not exists
         session_store.create_session(session_id)
@@ -1726,7 +1767,11 @@ def simple_test_page(session_id):
 def api_collect():
     """Receive initial snapshot from mobile collector"""
     try:
-        data = request.json
+        # Reject oversized payloads before parsing JSON
+        if request.content_length and request.content_length > MAX_SNAPSHOT_BYTES:
+            return jsonify({'error': f'Snapshot too large (max {MAX_SNAPSHOT_BYTES} bytes)'}), 413
+        
+        data = request.get_json(silent=True)
         if not data:
             return jsonify({'error': 'No JSON data received'}), 400
         
@@ -1734,80 +1779,27 @@ def api_collect():
         if not session_id:
             return jsonify({'error': 'Missing sessionId'}), 400
         
-        app.logger.info(f"[COLLECTOR] POST received for sessionId: {session_id}")
-        print(f"[COLLECTOR] POST received for sessionId: {session_id}")
-        
         # Validate required fields
         if 'snapshot' not in data:
             return jsonify({'error': 'Missing snapshot data'}), 400
         
-        snapshot = data['snapshot']
         timestamp = datetime.now().isoformat()
         
-        # Ensure sessionId is in snapshot (for consistency)
-        if 'sessionId' not in snapshot:
-            snapshot['sessionId'] = session_id
-        
-        # Normalize storage data: prefer new sandbox format, keep old format for backward compatibility
-        if 'storage' in snapshot and isinstance(snapshot['storage'], dict):
-            storage = snapshot['storage']
-            # If we have new format, ensure all fields are present
-            if 'storageSandboxQuotaMB' in storage or 'storageSandboxUsedMB' in storage:
-                # Calculate usage percent if not present
-                if 'storageSandboxUsagePercent' not in storage:
-                    quota_mb = storage.get('storageSandboxQuotaMB', 0)
-                    used_mb = storage.get('storageSandboxUsedMB', 0)
-                    if quota_mb > 0:
-                        storage['storageSandboxUsagePercent'] = round((used_mb / quota_mb) * 100)
-                # Ensure storageSource is set
-                if 'storageSource' not in storage:
-                    storage['storageSource'] = 'browser-sandbox'
-            # If we only have old format (quota/usage in bytes), convert to MB for new fields
-            elif 'quota' in storage and 'usage' in storage:
-                quota_bytes = storage.get('quota', 0)
-                usage_bytes = storage.get('usage', 0)
-                storage['storageSandboxQuotaMB'] = round(quota_bytes / (1024 * 1024))
-                storage['storageSandboxUsedMB'] = round(usage_bytes / (1024 * 1024))
-                if quota_bytes > 0:
-                    storage['storageSandboxUsagePercent'] = round((usage_bytes / quota_bytes) * 100)
-                storage['storageSource'] = 'browser-sandbox'
-        
-        # Normalize battery data: ensure batteryLevel and batteryCharging are at top level
-        if 'battery' in snapshot and isinstance(snapshot['battery'], dict):
-            battery = snapshot['battery']
-            if 'level' in battery:
-                snapshot['batteryLevel'] = battery.get('level')
-            if 'charging' in battery:
-                snapshot['batteryCharging'] = battery.get('charging')
-        # If batteryLevel/batteryCharging are already at top level, ensure battery object exists
-        elif 'batteryLevel' in snapshot:
-            if 'battery' not in snapshot:
-                snapshot['battery'] = {}
-            snapshot['battery']['level'] = snapshot.get('batteryLevel')
-            snapshot['battery']['charging'] = snapshot.get('batteryCharging', False)
-        
-        # Ensure insecureContext is set
-        if 'insecureContext' not in snapshot:
-            snapshot['insecureContext'] = not is_secure_request()
-        
-        # Add metadata
-        snapshot_with_meta = {
-            **snapshot,
-            'timestamp': timestamp,
-            'source': 'web'
-        }
+        # Validate and normalize in one pass (storage MB fields, top-level battery fields, metadata)
+        try:
+            snapshot_with_meta = normalize_snapshot(data['snapshot'], session_id, not is_secure_request(), timestamp)
+        except SnapshotValidationError as e:
+            return jsonify({'error': f'Invalid snapshot: {e}'}), 400
+        snapshot = snapshot_with_meta
         
         # Log received fields for debugging
-        app.logger.info(f"[COLLECTOR] Snapshot fields: batteryLevel={snapshot.get('batteryLevel')}, batteryCharging={snapshot.get('batteryCharging')}, "
-                       f"insecureContext={snapshot.get('insecureContext')}, "
-                       f"storageSandboxUsedMB={snapshot.get('storage', {}).get('storageSandboxUsedMB')}, "
-                       f"storageSandboxQuotaMB={snapshot.get('storage', {}).get('storageSandboxQuotaMB')}, "
-                       f"storageSandboxUsagePercent={snapshot.get('storage', {}).get('storageSandboxUsagePercent')}")
-        print(f"[COLLECTOR] Snapshot fields: batteryLevel={snapshot.get('batteryLevel')}, batteryCharging={snapshot.get('batteryCharging')}, "
-              f"insecureContext={snapshot.get('insecureContext')}, "
-              f"storageSandboxUsedMB={snapshot.get('storage', {}).get('storageSandboxUsedMB')}, "
-              f"storageSandboxQuotaMB={snapshot.get('storage', {}).get('storageSandboxQuotaMB')}, "
-              f"storageSandboxUsagePercent={snapshot.get('storage', {}).get('storageSandboxUsagePercent')}")
+        storage = snapshot.get('storage') or {}
+        hot_log.info(('collect', session_id), '[COLLECTOR] snapshot received', session=session_id,
+                     batteryLevel=snapshot.get('batteryLevel'), batteryCharging=snapshot.get('batteryCharging'),
+                     insecureContext=snapshot.get('insecureContext'),
+                     storageSandboxUsedMB=storage.get('storageSandboxUsedMB'),
+                     storageSandboxQuotaMB=storage.get('storageSandboxQuotaMB'),
+                     storageSandboxUsagePercent=storage.get('storageSandboxUsagePercent'))
         
         # Store snapshot in session store (this will broadcast to SSE)
         session_store.set_snapshot(session_id, snapshot_with_meta)
@@ -1816,10 +1808,10 @@ def api_collect():
         sess = session_store.get_session(session_id)
         if sess and 'battery' in snapshot:
             battery = snapshot['battery']
-            if isinstance(battery, dict) and 'level' in battery:
+            if isinstance(battery, dict) and battery.get('level') is not None:
                 battery_sample = {
                     'ts': int(time.time() * 1000),
-                    'pct': float(battery.get('level', 0)),
+                    'pct': float(battery['level']),
                     'charging': bool(battery.get('charging', False))
                 }
                 sess['battery_samples'].append(battery_sample)
@@ -1830,7 +1822,8 @@ def api_collect():
             sess['prediction'] = prediction
             # Broadcast prediction update
             session_store._broadcast(session_id, {'type': 'prediction', 'data': prediction})
-            app.logger.info(f"[PREDICTION] Recomputed for session {session_id}: {prediction.get('status', 'unknown')}")
+            hot_log.info(('prediction', session_id), '[PREDICTION] recomputed', session=session_id,
+                         status=prediction.get('status', 'unknown'))
         
         # Also save to file for backward compatibility
         phone_data_dir = os.path.join('static', 'phone_data')
@@ -1896,7 +1889,8 @@ def api_live_battery():
             'ts': client_ts or int(time.time() * 1000)  # Keep client timestamp
         }
         
-        app.logger.info(f"[BATTERY] Update received for session {session_id}: {battery_data['level']}% ({'charging' if battery_data['charging'] else 'not charging'})")
+        hot_log.info(('battery', session_id), '[BATTERY] update received', session=session_id,
+                     level=battery_data['level'], charging=bool(battery_data['charging']))
         
         # Store live battery update (this will broadcast to SSE and add to battery_samples deque)
         session_store.set_live(session_id, battery_data)
@@ -1908,7 +1902,8 @@ def api_live_battery():
             sess['prediction'] = prediction
             # Broadcast prediction update
             session_store._broadcast(session_id, {'type': 'prediction', 'data': prediction})
-            app.logger.debug(f"[PREDICTION] Recomputed for session {session_id}: {prediction.get('status', 'unknown')}, samples={prediction.get('sampleCount', 0)}")
+            hot_log.debug(('prediction', session_id), '[PREDICTION] recomputed', session=session_id,
+                          status=prediction.get('status', 'unknown'), samples=prediction.get('samplesCount', 0))
             
             # Recompute verified score on non-charging battery updates
             if not battery_data.get('charging', False) and sess.get('device_info'):
@@ -1931,6 +1926,16 @@ def api_live_battery():
         app.logger.error(f"Error in /api/live-battery: {str(e)}")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+@app.route('/api/ingest-stats')
+def api_ingest_stats():
+    """Admission-control counters (admitted / shed per endpoint) and current global load"""
+    return jsonify({
+        'success': True,
+        'enabled': app.config['INGEST_RATE_LIMIT_ENABLED'],
+        'load': round(ingest_limiter.load(), 3),
+        'endpoints': ingest_limiter.stats()
+    })
+
 @app.route('/api/session/<session_id>')
 def api_session(session_id):
     """Get full session object"""
@@ -2000,7 +2005,6 @@ def api_stream(session_id):
             queue.append(message)
         
         app.logger.info(f"[SSE] Opening stream for sessionId: {session_id}")
-        print(f"[SSE] Opening stream for sessionId: {session_id}")
         # Ensure session exists (create if not exists)
         if not session_store.get_session(session_id):
             session_store.create_session(session_id)
@@ -2030,8 +2034,8 @@ def api_stream(session_id):
                     update = queue.pop(0)
                     message_str = json.dumps(update)
                     yield f"data: {message_str}\n\n"
-                    app.logger.info(f"[SSE] Broadcast sent for session {session_id}: {update.get('type', 'unknown')}")
-                    print(f"[SSE] Broadcast sent for session {session_id}: {update.get('type', 'unknown')}")
+                    hot_log.debug(('sse_frame', session_id), '[SSE] frame sent', session=session_id,
+                                  type=update.get('type', 'unknown'))
                 
                 time.sleep(0.1)  # Check for updates every 100ms for faster updates
         finally:
@@ -2936,6 +2940,12 @@ def graceful_shutdown(signum=None, frame=None):
         app.logger.error(f"Error signaling PDF worker shutdown: {e}")
     
     app.logger.info("Graceful shutdown complete")
+    
+    # Flush queued log records last so the messages above are written
+    global log_listener
+    if log_listener:
+        log_listener.stop()
+        log_listener = None
 
 # Register shutdown handlers
 signal.signal(signal.SIGINT, graceful_shutdown)
@@ -0,0 +1,82 @@
+"""
+Unit tests for ingest admission control.
+Tests token bucket refill, per-session shedding, global shedding and the 429 response.
+"""
+
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.rate_limit import TokenBucket, AdmissionController
+from app import app, ingest_limiter
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Test TokenBucket arithmetic"""
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=2.0, capacity=2, now=0.0)
+        self.assertEqual(bucket.take(0.0), 0.0)
+        self.assertEqual(bucket.take(0.0), 0.0)
+        self.assertAlmostEqual(bucket.take(0.0), 0.5)
+        # Half a second later one token has been refilled
+        self.assertEqual(bucket.take(0.5), 0.0)
+
+    def test_idle_since(self):
+        bucket = TokenBucket(rate=1.0, capacity=2, now=0.0)
+        bucket.take(0.0)
+        self.assertFalse(bucket.idle_since(0.5))
+        self.assertTrue(bucket.idle_since(1.0))
+
+
+class TestAdmissionController(unittest.TestCase):
+    """Test per-session and global shedding"""
+
+    def test_per_session_isolation(self):
+        controller = AdmissionController({'ingest': (0.0, 2)}, global_rate=100, global_burst=100)
+        self.assertTrue(controller.admit('ingest', 'a')[0])
+        self.assertTrue(controller.admit('ingest', 'a')[0])
+        self.assertFalse(controller.admit('ingest', 'a')[0])
+        # Another session still has its own budget
+        self.assertTrue(controller.admit('ingest', 'b')[0])
+        stats = controller.stats()
+        self.assertEqual(stats['ingest']['admitted'], 3)
+        self.assertEqual(stats['ingest']['shed_session'], 1)
+
+    def test_global_shedding_refunds_session(self):
+        controller = AdmissionController({'ingest': (0.0, 5)}, global_rate=0.0, global_burst=1)
+        self.assertTrue(controller.admit('ingest', 'a')[0])
+        allowed, retry_after = controller.admit('ingest', 'b')
+        self.assertFalse(allowed)
+        self.assertEqual(controller.stats()['ingest']['shed_global'], 1)
+        self.assertEqual(controller.load(), 1.0)
+
+
+class TestIngestEndpoint(unittest.TestCase):
+    """Test 429 responses from the ingest endpoints"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_live_battery_storm_is_shed(self):
+        burst = int(ingest_limiter.policies['api_live_battery'][1])
+        payload = {'sid': 'storm', 'level': 80, 'charging': False}
+        statuses = [
+            self.client.post('/api/live-battery?sid=storm', json=payload).status_code
+            for _ in range(burst + 3)
+        ]
+        self.assertIn(429, statuses)
+        response = self.client.post('/api/live-battery?sid=storm', json=payload)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+
+    def test_stats_endpoint(self):
+        data = self.client.get('/api/ingest-stats').get_json()
+        self.assertTrue(data['success'])
+        self.assertIn('api_live_battery', data['endpoints'])
+
+
+if __name__ == '__main__':
+    unittest.main()
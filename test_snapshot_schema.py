@@ -0,0 +1,85 @@
+"""
+Unit tests for the compiled snapshot normalizer used by /api/collect.
+Tests storage/battery normalization, validation errors and the endpoint's early rejection.
+"""
+
+import unittest
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.snapshot_schema import normalize_snapshot, SnapshotValidationError, MAX_SNAPSHOT_BYTES
+from app import app, session_store
+
+
+class TestNormalizeSnapshot(unittest.TestCase):
+    """Test normalize_snapshot canonical output"""
+
+    def normalize(self, snapshot):
+        return normalize_snapshot(snapshot, 'sid-1', True, '2025-01-01T00:00:00')
+
+    def test_sandbox_storage_percent_filled(self):
+        result = self.normalize({'storage': {'storageSandboxQuotaMB': 200, 'storageSandboxUsedMB': 50}})
+        self.assertEqual(result['storage']['storageSandboxUsagePercent'], 25)
+        self.assertEqual(result['storage']['storageSource'], 'browser-sandbox')
+
+    def test_legacy_storage_converted_to_mb(self):
+        mb = 1024 * 1024
+        result = self.normalize({'storage': {'quota': 400 * mb, 'usage': 100 * mb}})
+        self.assertEqual(result['storage']['storageSandboxQuotaMB'], 400)
+        self.assertEqual(result['storage']['storageSandboxUsedMB'], 100)
+        self.assertEqual(result['storage']['storageSandboxUsagePercent'], 25)
+
+    def test_battery_object_flattened(self):
+        result = self.normalize({'battery': {'level': 72, 'charging': True}})
+        self.assertEqual(result['batteryLevel'], 72)
+        self.assertTrue(result['batteryCharging'])
+
+    def test_top_level_battery_builds_object(self):
+        result = self.normalize({'batteryLevel': '64', 'batteryCharging': False})
+        self.assertEqual(result['battery'], {'level': 64.0, 'charging': False})
+
+    def test_null_battery_and_storage_accepted(self):
+        result = self.normalize({'battery': None, 'batteryLevel': None, 'storage': None})
+        self.assertIsNone(result['battery'])
+        self.assertIsNone(result['storage'])
+
+    def test_metadata_added_without_mutating_input(self):
+        raw = {'platform': 'Linux armv8l'}
+        result = self.normalize(raw)
+        self.assertEqual(result['sessionId'], 'sid-1')
+        self.assertTrue(result['insecureContext'])
+        self.assertEqual(result['source'], 'web')
+        self.assertNotIn('source', raw)
+
+    def test_malformed_fields_rejected(self):
+        with self.assertRaises(SnapshotValidationError):
+            self.normalize({'battery': {'level': 250}})
+        with self.assertRaises(SnapshotValidationError):
+            self.normalize({'deviceMemory': 'lots'})
+        with self.assertRaises(SnapshotValidationError):
+            self.normalize({'storage': 'full'})
+        with self.assertRaises(SnapshotValidationError):
+            self.normalize(['not', 'an', 'object'])
+
+
+class TestCollectEndpoint(unittest.TestCase):
+    """Test /api/collect validation and size limits"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_oversized_payload_rejected(self):
+        body = json.dumps({'sessionId': 'big', 'snapshot': {'pad': 'x' * MAX_SNAPSHOT_BYTES}})
+        response = self.client.post('/api/collect', data=body, content_type='application/json')
+        self.assertEqual(response.status_code, 413)
+
+    def test_malformed_snapshot_rejected(self):
+        response = self.client.post('/api/collect', json={'sessionId': 'bad', 'snapshot': {'battery': 'full'}})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
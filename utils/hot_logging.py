@@ -0,0 +1,120 @@
+"""
+Structured, lazily formatted logging for request hot paths.
+
+Messages are logged as an event name plus key=value fields. Nothing is
+formatted unless the record is actually emitted, and each log key is
+subject to 1-in-N sampling and a token-bucket rate limit so a busy
+session cannot flood the log. A QueueHandler moves handler I/O off the
+request thread.
+"""
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+class _Fields:
+    """Deferred key=value rendering; only formatted if the record is emitted"""
+    __slots__ = ('fields',)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return ' '.join(f"{k}={v}" for k, v in self.fields.items())
+
+
+class RateLimitedLogger:
+    """
+    Wraps a logging.Logger with per-key sampling and rate limiting.
+    rate/burst define a token bucket per key (records per second, max burst).
+    When records were dropped, the next emitted record for that key reports
+    how many were suppressed.
+    """
+
+    def __init__(self, logger, rate=1.0, burst=5, echo=False):
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self.echo = echo  # Also print emitted records to stdout (legacy behaviour)
+        self._buckets = {}  # key -> [tokens, last_refill, suppressed, seen]
+        self._lock = threading.Lock()
+
+    def _admit(self, key, sample_every):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0, 0]
+            bucket[3] += 1
+            if sample_every > 1 and bucket[3] % sample_every != 1:
+                bucket[2] += 1
+                return None
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return None
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+            return suppressed
+
+    def log(self, level, key, event, /, sample_every=1, **fields):
+        """Log `event` with structured fields under rate-limit key `key`"""
+        if not self.logger.isEnabledFor(level) and not self.echo:
+            return
+        suppressed = self._admit(key, sample_every)
+        if suppressed is None:
+            return
+        if suppressed:
+            fields['suppressed'] = suppressed
+        self.logger.log(level, "%s %s", event, _Fields(fields))
+        if self.echo:
+            print(f"{event} {_Fields(fields)}")
+
+    def debug(self, key, event, /, **fields):
+        self.log(logging.DEBUG, key, event, **fields)
+
+    def info(self, key, event, /, **fields):
+        self.log(logging.INFO, key, event, **fields)
+
+    def warning(self, key, event, /, **fields):
+        self.log(logging.WARNING, key, event, **fields)
+
+    def forget(self, scope):
+        """Drop rate-limit state for keys scoped to `scope` (e.g. an expired session id)"""
+        with self._lock:
+            for key in [k for k in self._buckets if isinstance(k, tuple) and k[-1] == scope]:
+                del self._buckets[key]
+
+
+def install_queue_handler(logger, maxsize=10000):
+    """
+    Move logger's handlers behind a non-blocking QueueHandler.
+    Falls back to the root logger's handlers when logger has none of its own.
+    Returns the started QueueListener (call .stop() on shutdown).
+    """
+    target = logger if logger.handlers else logging.getLogger()
+    handlers = list(target.handlers)
+    log_queue = queue.Queue(maxsize)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    for handler in handlers:
+        target.removeHandler(handler)
+    target.addHandler(_DroppingQueueHandler(log_queue))
+    listener.start()
+    return listener
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def prepare(self, record):
+        # Leave formatting to the listener thread (the default prepare() formats here)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
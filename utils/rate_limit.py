@@ -0,0 +1,110 @@
+"""
+Token-bucket admission control for collector ingest endpoints.
+
+Each request is checked against a per-key bucket (usually the session id)
+and a shared global bucket before its body is read. Rejected requests are
+counted so shed load is visible.
+"""
+import math
+import threading
+import time
+from collections import Counter
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `capacity`"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def take(self, now, cost=1.0):
+        """Consume `cost` tokens. Returns 0.0 if admitted, else seconds until enough tokens exist."""
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (cost - self.tokens) / self.rate
+
+    def refund(self, cost=1.0):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def idle_since(self, now):
+        """True once the bucket would have refilled completely (safe to forget)"""
+        if self.rate <= 0:
+            return False
+        return now - self.updated >= (self.capacity - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Per-key and global token buckets for a set of named endpoint policies.
+    policies: { name: (per_key_rate, per_key_burst) }; all policies share
+    one global bucket of (global_rate, global_burst).
+    """
+
+    def __init__(self, policies, global_rate, global_burst, max_keys=10000):
+        self.policies = dict(policies)
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_keys = max_keys
+        self._buckets = {}  # (policy, key) -> TokenBucket
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def admit(self, policy, key):
+        """
+        Returns (allowed, retry_after_seconds). Cheap enough to run before
+        the request body is read.
+        """
+        rate, burst = self.policies[policy]
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get((policy, key))
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                bucket = self._buckets[(policy, key)] = TokenBucket(rate, burst, now)
+
+            wait = bucket.take(now)
+            if wait:
+                self._counters[(policy, 'shed_session')] += 1
+                return False, wait
+
+            wait = self.global_bucket.take(now)
+            if wait:
+                bucket.refund()
+                self._counters[(policy, 'shed_global')] += 1
+                return False, wait
+
+            self._counters[(policy, 'admitted')] += 1
+            return True, 0.0
+
+    def _prune(self, now):
+        for bucket_key in [k for k, b in self._buckets.items() if b.idle_since(now)]:
+            del self._buckets[bucket_key]
+
+    def load(self):
+        """Fraction of the global burst currently in use (0.0 idle .. 1.0 saturated)"""
+        with self._lock:
+            bucket = self.global_bucket
+            bucket._refill(time.monotonic())
+            return 1.0 - bucket.tokens / bucket.capacity
+
+    def stats(self):
+        """Counters per policy: admitted, shed_session, shed_global"""
+        with self._lock:
+            result = {name: {'admitted': 0, 'shed_session': 0, 'shed_global': 0} for name in self.policies}
+            for (policy, outcome), count in self._counters.items():
+                result[policy][outcome] = count
+            result['tracked_keys'] = len(self._buckets)
+            return result
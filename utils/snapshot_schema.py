@@ -0,0 +1,182 @@
+"""
+Schema-driven normalizer for collector snapshots posted to /api/collect.
+
+The schema below is compiled once at import into a flat dispatch table so a
+snapshot is validated, coerced and flattened into its canonical stored form
+in a single pass over its keys.
+"""
+import math
+
+# Upper bounds for a single /api/collect request (checked before JSON parsing)
+MAX_SNAPSHOT_BYTES = 64 * 1024
+MAX_SNAPSHOT_KEYS = 128
+MAX_STRING_LENGTH = 2048
+
+BYTES_PER_MB = 1024 * 1024
+
+
+class SnapshotValidationError(ValueError):
+    """Raised when a snapshot is oversized or malformed"""
+
+
+def _number(value, field):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise SnapshotValidationError(f"{field} must be a number")
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not math.isfinite(value):
+            return None  # Infinity/NaN from the Battery API are "unknown"
+        return value
+    if isinstance(value, str):
+        try:
+            parsed = float(value)
+        except ValueError:
+            raise SnapshotValidationError(f"{field} must be a number")
+        return parsed if math.isfinite(parsed) else None
+    raise SnapshotValidationError(f"{field} must be a number")
+
+
+def _percent(value, field):
+    value = _number(value, field)
+    if value is not None and not 0 <= value <= 100:
+        raise SnapshotValidationError(f"{field} must be between 0 and 100")
+    return value
+
+
+def _boolean(value, field):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes')
+    raise SnapshotValidationError(f"{field} must be a boolean")
+
+
+def _string(value, field):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = str(value)
+    if len(value) > MAX_STRING_LENGTH:
+        raise SnapshotValidationError(f"{field} exceeds {MAX_STRING_LENGTH} characters")
+    return value
+
+
+def _object(value, field):
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise SnapshotValidationError(f"{field} must be an object")
+    if len(value) > MAX_SNAPSHOT_KEYS:
+        raise SnapshotValidationError(f"{field} has too many keys")
+    return value
+
+
+def _battery(value, field):
+    value = _object(value, field)
+    if value is None:
+        return None
+    battery = dict(value)
+    if 'level' in battery:
+        battery['level'] = _percent(battery['level'], 'battery.level')
+    if 'charging' in battery:
+        battery['charging'] = _boolean(battery['charging'], 'battery.charging')
+    return battery
+
+
+def _storage(value, field):
+    value = _object(value, field)
+    if value is None:
+        return None
+    storage = dict(value)
+    if 'storageSandboxQuotaMB' in storage or 'storageSandboxUsedMB' in storage:
+        # New sandbox format (MB): fill in usage percent and source
+        quota_mb = _number(storage.get('storageSandboxQuotaMB'), 'storage.storageSandboxQuotaMB') or 0
+        used_mb = _number(storage.get('storageSandboxUsedMB'), 'storage.storageSandboxUsedMB') or 0
+        if 'storageSandboxUsagePercent' not in storage and quota_mb > 0:
+            storage['storageSandboxUsagePercent'] = round((used_mb / quota_mb) * 100)
+        storage.setdefault('storageSource', 'browser-sandbox')
+    elif 'quota' in storage and 'usage' in storage:
+        # Legacy format (bytes): derive the MB fields
+        quota_bytes = _number(storage.get('quota'), 'storage.quota') or 0
+        usage_bytes = _number(storage.get('usage'), 'storage.usage') or 0
+        storage['storageSandboxQuotaMB'] = round(quota_bytes / BYTES_PER_MB)
+        storage['storageSandboxUsedMB'] = round(usage_bytes / BYTES_PER_MB)
+        if quota_bytes > 0:
+            storage['storageSandboxUsagePercent'] = round((usage_bytes / quota_bytes) * 100)
+        storage['storageSource'] = 'browser-sandbox'
+    return storage
+
+
+# Declarative schema: field -> coercer. Unknown fields are kept as-is.
+SNAPSHOT_SCHEMA = {
+    'sessionId': _string,
+    'userAgent': _string,
+    'platform': _string,
+    'language': _string,
+    'model': _string,
+    'manufacturer': _string,
+    'screenWidth': _number,
+    'screenHeight': _number,
+    'pixelRatio': _number,
+    'hardwareConcurrency': _number,
+    'deviceMemory': _number,
+    'batteryLevel': _percent,
+    'batteryCharging': _boolean,
+    'insecureContext': _boolean,
+    'battery': _battery,
+    'storage': _storage,
+    'network': _object,
+    'gpu': _object,
+    'clientHints': _object,
+    'responsiveness': None,  # dict {'index': n} or a bare number; passed through
+}
+
+
+def _compile(schema):
+    """Build the key -> coercer dispatch table used by normalize_snapshot"""
+    return {field: coercer for field, coercer in schema.items() if coercer is not None}
+
+
+_COERCERS = _compile(SNAPSHOT_SCHEMA)
+
+
+def normalize_snapshot(snapshot, session_id, insecure_context, timestamp):
+    """
+    Validate, coerce and flatten a raw collector snapshot in a single pass.
+    Returns a new dict in canonical stored form (battery object and top-level
+    batteryLevel/batteryCharging agree, storage carries MB fields, metadata added).
+    Raises SnapshotValidationError for malformed input.
+    """
+    if not isinstance(snapshot, dict):
+        raise SnapshotValidationError('snapshot must be an object')
+    if len(snapshot) > MAX_SNAPSHOT_KEYS:
+        raise SnapshotValidationError('snapshot has too many keys')
+
+    normalized = {}
+    for key, value in snapshot.items():
+        coercer = _COERCERS.get(key)
+        normalized[key] = coercer(value, key) if coercer else value
+
+    normalized.setdefault('sessionId', session_id)
+
+    battery = normalized.get('battery')
+    if isinstance(battery, dict):
+        if 'level' in battery:
+            normalized['batteryLevel'] = battery['level']
+        if 'charging' in battery:
+            normalized['batteryCharging'] = battery['charging']
+    elif normalized.get('batteryLevel') is not None:
+        normalized['battery'] = {
+            'level': normalized['batteryLevel'],
+            'charging': normalized.get('batteryCharging') or False
+        }
+
+    if 'insecureContext' not in normalized:
+        normalized['insecureContext'] = insecure_context
+
+    normalized['timestamp'] = timestamp
+    normalized['source'] = 'web'
+    return normalized